@@ -1,76 +1,266 @@
 """
 get configuration parameters for base runtime smoke testing
+
+The parameters are resolved into a BrtConfig object, and the settings a
+test script needs are validated in one go. The parts that are expensive to
+read (the mock configuration and the expected installed packages list) are
+loaded the first time they are used.
+
+The resolution and the parts loaded so far are saved as JSON to a cache
+file, so that later test processes and phases run with the same parameters
+reuse them instead of loading them again. Parts are reloaded when their
+file changes. The cache file is given by the avocado 'brtconfig-cache'
+parameter or the BRTCONFIG_CACHE environment variable, and defaults to a
+per-user file in the temporary directory; an empty path disables it.
 """
 
+import getpass
+import json
 import os
 import logging
+import re
+import tempfile
+
+import pkgdiff
+
 
+log = logging.getLogger('avocado.test')
 
-def get_mockcfg(self):
+SCRIPT_DIR = os.path.abspath(os.path.dirname(__file__))
+
+DEFAULT_CACHE = os.path.join(tempfile.gettempdir(),
+                             "brtconfig-%s.json" % getpass.getuser())
+
+
+def parse_mockcfg(mockcfg):
     """
-    Get the path to the base runtime mock configuration file
+    Read the settings the tests need from a mock configuration file
 
-    This is provided by the avocado 'mockcfg' parameter if supplied,
-    otherwise it is set to "resources/base-runtime-mock.cfg" relative to
-    the test script directory.
+    Returns a dict with the mock 'root' (empty if not set), whether 'chroot_setup_cmd' is defined and the sorted list of
+    packages it installs ('chroot_setup_pkgs', None if there are none).
     """
 
-    script_dir = os.path.abspath(os.path.dirname(__file__))
-    self.log.info("running script from directory: %s" % script_dir)
+    model = {
+        'root': '',
+        'chroot_setup_cmd': False,
+        'chroot_setup_pkgs': None,
+    }
+    #Regex to get packages that are configured on mockcfg to be installed
+    chroot_setup_pkg_regex = re.compile("config_opts\s*\[\s*'chroot_setup_cmd'\s*\]\s*="
+                                        "\s*'install --setopt=tsflags=nodocs\s*(.*)\s*'")
+    with open(mockcfg, 'r') as mock_cfgfile:
+        for line in mock_cfgfile:
+            if re.match("config_opts\s*\[\s*'root'\s*\]", line) is not None:
+                model['root'] = line.split('=')[1].split("'")[1]
+            if re.match("config_opts\s*\[\s*'chroot_setup_cmd'\s*\]", line) is not None:
+                model['chroot_setup_cmd'] = True
+                #Check if there are packages defined on chroot_setup_cmd
+                m = chroot_setup_pkg_regex.match(line)
+                if m:
+                    model['chroot_setup_pkgs'] = sorted(m.group(1).split())
+    return model
 
-    mockcfg = self.params.get('mockcfg', default=os.path.join(
-        script_dir, "resources", "base-runtime-mock.cfg"))
-    mockcfg = str(mockcfg)
 
-    if not mockcfg.endswith(".cfg"):
-        self.error("mock configuration file %s must have the extension '.cfg'" %
-                   mockcfg)
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
 
-    if not os.path.isfile(mockcfg):
-        self.error("mock configuration file %s does not exist" %
-                   mockcfg)
 
-    self.log.info("mock configuration file: %s" % mockcfg)
+class BrtConfig(object):
+    """
+    Resolved configuration for base runtime smoke testing
+    """
 
-    return mockcfg
+    # lazily loaded parts and the setting naming the file each depends on
+    PARTS = {
+        'mockcfg_model': 'mockcfg',
+        'installed_pkgs': 'installed_pkgs_list',
+    }
 
+    def __init__(self, settings, cache_path=None):
+        self.settings = settings
+        self.cache_path = cache_path
+        self._parts = {}
+        self._mtimes = {}
 
-def get_compiler_test_dir(self):
-    """
-    Get the path to the base runtime compiler test resource directory
+    def __getattr__(self, name):
+        settings = self.__dict__.get('settings', {})
+        if name in settings:
+            return settings[name]
+        raise AttributeError(name)
 
-    This is provided by the avocado 'compiler-test-dir' parameter if supplied,
-    otherwise it is set to "resources/hello-world" relative to
-    the test script directory.
-    """
+    @classmethod
+    def from_params(cls, params):
+        """
+        Resolve the configuration from avocado test parameters
+        """
+
+        interval = params.get('profile-interval', default=1.0)
+        try:
+            interval = float(interval)
+        except (TypeError, ValueError):
+            # left as is for validate() to report
+            pass
+
+        settings = {
+            'script_dir': SCRIPT_DIR,
+            'mockcfg': str(params.get('mockcfg', default=os.path.join(
+                SCRIPT_DIR, "resources", "base-runtime-mock.cfg"))),
+            'compiler_test_dir': str(params.get('compiler-test-dir', default=os.path.join(
+                SCRIPT_DIR, "resources", "hello-world"))),
+            'docker_image_name': str(params.get(
+                'docker-image-name', default='base-runtime-smoke')),
+            'installed_pkgs_list': str(params.get('installed-pkgs-list', default=os.path.join(
+                SCRIPT_DIR, "resources", "installed_packages", "all_installed_pkgs.txt"))),
+            'profile_interval': interval,
+        }
+        cache_path = params.get('brtconfig-cache',
+                                default=os.environ.get('BRTCONFIG_CACHE', DEFAULT_CACHE))
+        return cls(settings, cache_path and str(cache_path))
+
+    def validate(self, required=None):
+        """
+        Check the settings named in required (all of them by default),
+        returning a list of error messages
+        """
+
+        errors = []
 
-    script_dir = os.path.abspath(os.path.dirname(__file__))
-    self.log.info("running script from directory: %s" % script_dir)
+        def check(name):
+            return required is None or name in required
 
-    compdir = self.params.get(
-        'compiler-test-dir', default=os.path.join(script_dir, "resources", "hello-world"))
-    compdir = str(compdir)
+        if check('mockcfg'):
+            if not self.mockcfg.endswith(".cfg"):
+                errors.append("mock configuration file %s must have the extension '.cfg'" %
+                              self.mockcfg)
 
-    if not os.path.isdir(compdir):
-        self.error("Compiler test resource directory %s does not exist" % compdir)
+            if not os.path.isfile(self.mockcfg):
+                errors.append("mock configuration file %s does not exist" %
+                              self.mockcfg)
 
-    self.log.info("Compiler test resource directory: %s" % compdir)
+        if check('compiler_test_dir'):
+            if not os.path.isdir(self.compiler_test_dir):
+                errors.append("Compiler test resource directory %s does not exist" %
+                              self.compiler_test_dir)
 
-    return compdir
+        if check('profile_interval'):
+            if not isinstance(self.profile_interval, float):
+                errors.append("profile interval %s is not a number" %
+                              self.profile_interval)
+            elif self.profile_interval < 0:
+                errors.append("profile interval %s must not be negative" %
+                              self.profile_interval)
 
+        return errors
 
-def get_docker_image_name(self):
+    def _load(self, part, loader):
+        if part not in self._parts:
+            path = self.settings[self.PARTS[part]]
+            self._mtimes[part] = _mtime(path)
+            self._parts[part] = loader(path)
+            self.save()
+        return self._parts[part]
+
+    @property
+    def mockcfg_model(self):
+        """
+        The settings read from the mock configuration file by parse_mockcfg()
+        """
+
+        return self._load('mockcfg_model', parse_mockcfg)
+
+    @property
+    def installed_pkgs(self):
+        """
+        The expected installed packages list loaded by pkgdiff.load_allowlist()
+        """
+
+        return self._load('installed_pkgs', pkgdiff.load_allowlist)
+
+    def to_dict(self):
+        return {
+            'settings': self.settings,
+            'parts': self._parts,
+            'mtimes': self._mtimes,
+        }
+
+    def update_from_dict(self, data):
+        """
+        Reuse the parts loaded by an earlier resolution with the same settings
+
+        Parts whose underlying file changed since they were loaded are
+        dropped and will be loaded again.
+        """
+
+        if data.get('settings') != self.settings:
+            return
+        for part, value in data.get('parts', {}).items():
+            mtime = data.get('mtimes', {}).get(part)
+            if part not in self.PARTS or mtime is None or \
+                    mtime != _mtime(self.settings[self.PARTS[part]]):
+                continue
+            if part == 'installed_pkgs':
+                value = dict((name, [tuple(c) for c in constraints])
+                             for name, constraints in value.items())
+            self._parts[part] = value
+            self._mtimes[part] = mtime
+
+    def save(self):
+        """
+        Save the configuration to the cache path, if there is one
+        """
+
+        if not self.cache_path:
+            return
+        # write to a temporary file first so that concurrent test processes
+        # never see a partially written cache
+        tmp_path = "%s.%d" % (self.cache_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.to_dict(), f)
+            os.rename(tmp_path, self.cache_path)
+        except (IOError, OSError, TypeError) as e:
+            log.warning("could not save configuration cache %s: %s" %
+                        (self.cache_path, e))
+
+    def load(self):
+        """
+        Load the configuration cache, if there is one
+        """
+
+        if not self.cache_path or not os.path.isfile(self.cache_path):
+            return
+        try:
+            with open(self.cache_path) as f:
+                self.update_from_dict(json.load(f))
+        except (IOError, ValueError):
+            log.warning("ignoring unreadable configuration cache %s" %
+                        self.cache_path)
+        else:
+            log.info("reusing configuration cache %s for: %s" %
+                     (self.cache_path, ", ".join(sorted(self._parts))))
+
+
+def get_config(self, required=None):
     """
-    Get the name to use for the base runtime docker image
+    Get the resolved base runtime configuration
 
-    This is provided by the avocado 'docker-image-name' parameter if supplied,
-    otherwise it is set to "base-runtime-smoke".
+    This is resolved from the avocado parameters. The settings named in
+    required (all of them by default) are validated at once and the test
+    errors out listing every problem found.
     """
 
-    image_name = self.params.get(
-        'docker-image-name', default='base-runtime-smoke')
-    image_name = str(image_name)
+    config = BrtConfig.from_params(self.params)
+    self.log.info("running script from directory: %s" % config.script_dir)
+
+    errors = config.validate(required)
+    if errors:
+        self.error("\n".join(errors))
 
-    self.log.info("base runtime image name: %s" % image_name)
+    for name in sorted(config.settings):
+        self.log.info("%s: %s" % (name, config.settings[name]))
 
-    return image_name
+    config.load()
+    return config
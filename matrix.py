@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+"""
+build and test the base runtime docker image for a matrix of composes and
+architectures
+
+For every (compose, arch) cell of the matrix configuration file, a mock
+configuration and a modularity testing framework configuration are
+generated from templates, and the setup, smoke and teardown phases are run
+against them with avocado. Cells run in parallel up to a configurable
+bound. The results of all cells are gathered into one matrix report.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+import yaml
+
+
+log = logging.getLogger('matrix')
+
+SCRIPT_DIR = os.path.abspath(os.path.dirname(__file__))
+
+PHASES = ["setup", "smoke", "teardown"]
+
+# architectures a host can run without emulation
+NATIVE_ARCHES = {
+    'x86_64': ('x86_64', 'i686', 'i586', 'i386'),
+    'aarch64': ('aarch64', 'armv7hl'),
+    'ppc64le': ('ppc64le',),
+    's390x': ('s390x',),
+}
+
+# binfmt_misc handler names registered by qemu-user-static
+QEMU_BINFMT = {
+    'i386': 'qemu-i386', 'i586': 'qemu-i386', 'i686': 'qemu-i386',
+    'x86_64': 'qemu-x86_64',
+    'armv7hl': 'qemu-arm',
+    'aarch64': 'qemu-aarch64',
+    'ppc64le': 'qemu-ppc64le',
+    's390x': 'qemu-s390x',
+}
+
+
+def load_matrix(path):
+    """
+    Load the matrix configuration file and expand it into a list of cells
+    """
+
+    with open(path) as f:
+        matrix = yaml.safe_load(f)
+
+    for key in ["template", "arches", "composes"]:
+        if not matrix.get(key):
+            raise ValueError("'%s' key was not found in matrix configuration %s" %
+                             (key, path))
+
+    cells = []
+    names = {}
+    for compose in sorted(matrix["composes"]):
+        compose_cfg = matrix["composes"][compose]
+        if "url" not in compose_cfg:
+            raise ValueError("compose '%s' does not define a 'url'" % compose)
+        for arch in compose_cfg.get("arches", matrix["arches"]):
+            cell = {
+                'compose': compose,
+                'arch': arch,
+                'url': compose_cfg["url"].replace("{arch}", arch),
+            }
+            # cells share their directory, mock root and docker image name
+            # if their names collide
+            name = _cell_name(cell)
+            if name in names:
+                raise ValueError("compose '%s' arch '%s' and compose '%s' arch "
+                                 "'%s' both map to the cell name '%s'" %
+                                 (names[name]['compose'], names[name]['arch'],
+                                  compose, arch, name))
+            names[name] = cell
+            cells.append(cell)
+    return matrix, cells
+
+
+def needs_emulation(arch, host_arch):
+    return arch not in NATIVE_ARCHES.get(host_arch, (host_arch,))
+
+
+def _cell_name(cell):
+    # docker image names and mock roots must be lowercase and simple
+    return re.sub('[^a-z0-9_.-]+', '-', "%s-%s" %
+                  (cell['compose'].lower(), cell['arch']))
+
+
+def render_mockcfg(template, cell, host_arch):
+    """
+    Rewrite a mock configuration for the compose and arch of a cell
+    """
+
+    root = "base-runtime-docker-%s" % _cell_name(cell)
+    arch = cell['arch']
+    legal_host_arches = tuple(sorted(set([arch, host_arch])))
+
+    lines = []
+    for line in template.splitlines(True):
+        if re.match("config_opts\s*\[\s*'root'\s*\]", line) is not None:
+            line = "config_opts['root'] = '%s'\n" % root
+        elif re.match("config_opts\s*\[\s*'target_arch'\s*\]", line) is not None:
+            line = "config_opts['target_arch'] = '%s'\n" % arch
+        elif re.match("config_opts\s*\[\s*'legal_host_arches'\s*\]", line) is not None:
+            line = "config_opts['legal_host_arches'] = %r\n" % (legal_host_arches,)
+        elif re.match("config_opts\s*\[\s*'forcearch'\s*\]", line) is not None:
+            continue
+        elif line.startswith("baseurl="):
+            line = "baseurl=%s\n" % cell['url']
+        lines.append(line)
+        if line.startswith("config_opts['target_arch']") and \
+                needs_emulation(arch, host_arch):
+            # build the chroot through qemu-user-static
+            lines.append("config_opts['forcearch'] = '%s'\n" % arch)
+    return "".join(lines)
+
+
+def render_config(config, cell, image_name):
+    """
+    Rewrite a modularity testing framework configuration for a cell
+    """
+
+    config = dict(config)
+    module = dict(config.get("module", {}))
+    docker = dict(module.get("docker", {}))
+    docker["container"] = "docker=%s" % image_name
+    module["docker"] = docker
+    rpm = dict(module.get("rpm", {}))
+    rpm["repos"] = [cell['url']]
+    module["rpm"] = rpm
+    config["module"] = module
+    return yaml.safe_dump(config, default_flow_style=False)
+
+
+def check_emulation(arch):
+    """
+    Check that a foreign arch can be run through qemu-user-static
+
+    Both mock and docker run the foreign binaries through the kernel's
+    binfmt_misc handler, which has to be registered with the 'F' (fix
+    binary) flag so it keeps working inside the chroot and containers.
+    Returns a message describing the problem, or None if there is none.
+    """
+
+    handler = QEMU_BINFMT.get(arch, "qemu-%s" % arch)
+    handler_path = os.path.join("/proc/sys/fs/binfmt_misc", handler)
+    try:
+        with open(handler_path) as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return ("no binfmt_misc handler %s registered to run %s binaries "
+                "(is qemu-user-static installed?)" % (handler, arch))
+
+    if "enabled" not in lines:
+        return "binfmt_misc handler %s is disabled" % handler
+
+    flags = [line.split(":", 1)[1].strip() for line in lines
+             if line.startswith("flags:")]
+    if not flags or "F" not in flags[0]:
+        return ("binfmt_misc handler %s is not registered with the 'F' flag, "
+                "so %s binaries can't be run inside docker containers" %
+                (handler, arch))
+
+    return None
+
+
+def _read_results(job_results_dir):
+    """
+    Read the test results of the latest avocado job in a results directory
+    """
+
+    results_path = os.path.join(job_results_dir, "latest", "results.json")
+    try:
+        with open(results_path) as f:
+            results = json.load(f)
+    except (IOError, ValueError):
+        return []
+
+    tests = []
+    for test in results.get("tests", []):
+        entry = {
+            'test': test.get("id") or test.get("test"),
+            'status': test.get("status"),
+        }
+        if test.get("fail_reason") and test.get("status") != "PASS":
+            entry['fail_reason'] = test["fail_reason"]
+        if test.get("whiteboard"):
+            try:
+                entry.update(json.loads(test["whiteboard"]))
+            except ValueError:
+                entry['whiteboard'] = test["whiteboard"]
+        tests.append(entry)
+    return tests
+
+
+def run_cell(cell, matrix, results_dir, host_arch):
+    """
+    Generate the configuration for a cell and run all phases against it
+    """
+
+    name = _cell_name(cell)
+    cell_dir = os.path.join(results_dir, name)
+    if not os.path.isdir(cell_dir):
+        os.makedirs(cell_dir)
+
+    image_name = "base-runtime-smoke-%s" % name
+    mockcfg = os.path.join(cell_dir, "base-runtime-mock.cfg")
+    config_path = os.path.join(cell_dir, "config.yaml")
+
+    with open(os.path.join(SCRIPT_DIR, matrix["template"])) as f:
+        template = f.read()
+    with open(mockcfg, 'w') as f:
+        f.write(render_mockcfg(template, cell, host_arch))
+
+    with open(os.path.join(SCRIPT_DIR, matrix.get("config", "config.yaml"))) as f:
+        config = yaml.safe_load(f)
+    with open(config_path, 'w') as f:
+        f.write(render_config(config, cell, image_name))
+
+    report = dict(cell)
+    report['image'] = image_name
+    report['phases'] = {}
+
+    if needs_emulation(cell['arch'], host_arch):
+        problem = check_emulation(cell['arch'])
+        if problem:
+            log.warning("%s: skipping cell, %s" % (name, problem))
+            report['status'] = "SKIP"
+            report['reason'] = problem
+            return report
+
+    env = dict(os.environ)
+    env["CONFIG"] = config_path
+
+    for phase in PHASES:
+        if phase == "smoke" and report['phases']["setup"]['status'] != "PASS":
+            log.warning("%s: skipping smoke tests, image setup failed" % name)
+            report['phases'][phase] = {'status': "SKIP", 'tests': []}
+            continue
+
+        job_results_dir = os.path.join(cell_dir, phase)
+        cmdline = ["avocado", "run", "%s.py" % phase,
+                   "--job-results-dir", job_results_dir,
+                   "--mux-inject",
+                   "run:mockcfg:%s" % mockcfg,
+                   "run:docker-image-name:%s" % image_name,
+                   "run:brtconfig-cache:%s" % os.path.join(cell_dir, "brtconfig.json")]
+        log.info("%s: running '%s'" % (name, " ".join(cmdline)))
+        with open(os.path.join(cell_dir, "%s.log" % phase), 'w') as phase_log:
+            returncode = subprocess.call(cmdline, cwd=SCRIPT_DIR, env=env,
+                                         stdout=phase_log,
+                                         stderr=subprocess.STDOUT)
+        report['phases'][phase] = {
+            'status': "PASS" if returncode == 0 else "FAIL",
+            'tests': _read_results(job_results_dir),
+        }
+        log.info("%s: %s phase %s" % (name, phase,
+                                      report['phases'][phase]['status']))
+
+    report['status'] = "PASS" if all(
+        p['status'] == "PASS" for p in report['phases'].values()) else "FAIL"
+    return report
+
+
+def run_cell_safely(cell, matrix, results_dir, host_arch):
+    """
+    Run a cell, recording any unexpected exception as an ERROR report so
+    that the other cells still get reported
+    """
+
+    try:
+        return run_cell(cell, matrix, results_dir, host_arch)
+    except Exception as e:
+        log.exception("%s: cell failed with an unexpected error" %
+                      _cell_name(cell))
+        report = dict(cell)
+        report['status'] = "ERROR"
+        report['reason'] = "%s: %s" % (type(e).__name__, e)
+        report['phases'] = {}
+        return report
+
+
+def format_report(reports):
+    """
+    Format the cell reports as a compose by arch table of phase results
+    """
+
+    arches = sorted(set(r['arch'] for r in reports))
+    composes = sorted(set(r['compose'] for r in reports))
+    by_cell = dict(((r['compose'], r['arch']), r) for r in reports)
+
+    rows = [["compose"] + arches]
+    for compose in composes:
+        row = [compose]
+        for arch in arches:
+            report = by_cell.get((compose, arch))
+            if report is None:
+                row.append("-")
+                continue
+            if report['status'] in ("SKIP", "ERROR"):
+                row.append(report['status'])
+                continue
+            tests = report['phases']["smoke"]['tests']
+            passed = len([t for t in tests if t['status'] == "PASS"])
+            row.append("%s %d/%d" % ("/".join(
+                report['phases'][p]['status'] for p in PHASES),
+                passed, len(tests)))
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in
+                               zip(row, widths)).rstrip() for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--matrix", default=os.path.join(SCRIPT_DIR, "matrix.yaml"),
+                        help="matrix configuration file (default: %(default)s)")
+    parser.add_argument("--results-dir", default=os.path.join(SCRIPT_DIR, "matrix-results"),
+                        help="directory for generated configurations and "
+                        "results (default: %(default)s)")
+    parser.add_argument("--parallel", type=int,
+                        help="maximum number of cells to run at once "
+                        "(default: 'parallel' from the matrix configuration)")
+    parser.add_argument("--arch", action="append",
+                        help="only run this arch (may be repeated)")
+    parser.add_argument("--compose", action="append",
+                        help="only run this compose (may be repeated)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    matrix, cells = load_matrix(args.matrix)
+    if args.arch:
+        cells = [c for c in cells if c['arch'] in args.arch]
+    if args.compose:
+        cells = [c for c in cells if c['compose'] in args.compose]
+    if not cells:
+        parser.error("no matrix cells selected")
+
+    results_dir = os.path.abspath(args.results_dir)
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+
+    host_arch = platform.machine()
+    parallel = args.parallel or matrix.get("parallel", 1)
+    log.info("running %d matrix cells on %s, %d at a time" %
+             (len(cells), host_arch, parallel))
+
+    pool = ThreadPool(parallel)
+    try:
+        reports = pool.map(
+            lambda cell: run_cell_safely(cell, matrix, results_dir, host_arch), cells)
+    finally:
+        pool.close()
+        pool.join()
+
+    report_path = os.path.join(results_dir, "matrix_report.json")
+    with open(report_path, 'w') as f:
+        json.dump(reports, f, indent=2, sort_keys=True)
+        f.write("\n")
+    log.info("matrix report written to %s" % report_path)
+
+    print(format_report(reports))
+
+    for report in reports:
+        if report.get('reason'):
+            log.warning("%s: %s: %s" % (_cell_name(report), report['status'],
+                                        report['reason']))
+
+    # skipped cells are reported, but don't fail the run
+    failed = [r for r in reports if r['status'] in ("FAIL", "ERROR")]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,189 @@
+"""
+compare the packages installed in the base runtime image against an allowlist
+
+The allowlist file has one package per line in the form:
+
+    name [version-release [arch]]
+
+Blank lines and lines starting with '#' are ignored. A missing version or
+arch, or one given as '*', matches any installed version or arch. A package
+may be listed more than once (e.g. once per arch for multilib packages).
+"""
+
+import json
+import logging
+
+
+log = logging.getLogger('avocado.test')
+
+# rpm query format producing lines understood by parse_installed()
+RPM_QUERY_FORMAT = "%{name} %{version}-%{release} %{arch}\\n"
+
+ANY = '*'
+
+
+def _parse_line(line):
+    """
+    Split an allowlist or rpm query line into (name, version, arch)
+
+    Missing fields are returned as None.
+    """
+
+    fields = line.split()
+    fields += [None] * (3 - len(fields))
+    name, version, arch = fields[:3]
+    if version == ANY:
+        version = None
+    if arch == ANY:
+        arch = None
+    return name, version, arch
+
+
+def load_allowlist(path):
+    """
+    Load an allowlist file into a dict mapping package name to a list of
+    (version, arch) constraints
+    """
+
+    allowlist = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            name, version, arch = _parse_line(line)
+            allowlist.setdefault(name, []).append((version, arch))
+    return allowlist
+
+
+def parse_installed(output):
+    """
+    Parse the output of 'rpm -qa --qf=RPM_QUERY_FORMAT' into a dict mapping
+    package name to a list of installed (version, arch) tuples
+    """
+
+    installed = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        name, version, arch = _parse_line(line)
+        installed.setdefault(name, []).append((version, arch))
+    return installed
+
+
+def _matches(instance, constraints):
+    version, arch = instance
+    for exp_version, exp_arch in constraints:
+        if exp_version is not None and exp_version != version:
+            continue
+        if exp_arch is not None and exp_arch != arch:
+            continue
+        return True
+    return False
+
+
+def _format(instances):
+    return sorted(" ".join(field or ANY for field in instance)
+                  for instance in instances)
+
+
+def diff_packages(allowlist, installed):
+    """
+    Compare installed packages against an allowlist
+
+    Returns a dict with the following keys, each holding a list sorted by
+    package name:
+
+    added   - installed packages that are not in the allowlist
+    removed - allowlisted packages that are not installed
+    changed - packages in both where an installed version or arch does not
+              satisfy any of the allowlist constraints
+    """
+
+    diff = {'added': [], 'removed': [], 'changed': []}
+
+    for name in sorted(installed):
+        instances = installed[name]
+        constraints = allowlist.get(name)
+        if constraints is None:
+            diff['added'].append({
+                'name': name,
+                'installed': _format(instances)})
+            continue
+        unexpected = [i for i in instances if not _matches(i, constraints)]
+        if unexpected:
+            diff['changed'].append({
+                'name': name,
+                'expected': _format(constraints),
+                'installed': _format(unexpected)})
+
+    for name in sorted(allowlist):
+        if name not in installed:
+            diff['removed'].append({
+                'name': name,
+                'expected': _format(allowlist[name])})
+
+    return diff
+
+
+def has_drift(diff, strict=False):
+    """
+    Return True if the diff reports any added or changed packages
+
+    Expected packages that are not installed are only counted as drift if
+    strict is set.
+    """
+
+    keys = ('added', 'removed', 'changed') if strict else ('added', 'changed')
+    return any(diff[key] for key in keys)
+
+
+def format_diff(diff):
+    """
+    Format a diff as human readable text, one package per line
+    """
+
+    lines = []
+    for entry in diff['added']:
+        lines.append("+ %s (%s)" % (entry['name'],
+                                    ", ".join(entry['installed'])))
+    for entry in diff['removed']:
+        lines.append("- %s (%s)" % (entry['name'],
+                                    ", ".join(entry['expected'])))
+    for entry in diff['changed']:
+        lines.append("~ %s (expected %s, installed %s)" %
+                     (entry['name'], ", ".join(entry['expected']),
+                      ", ".join(entry['installed'])))
+    return "\n".join(lines)
+
+
+def write_diff(diff, path):
+    """
+    Write a diff to a file as JSON
+    """
+
+    with open(path, 'w') as f:
+        json.dump(diff, f, indent=2, sort_keys=True)
+        f.write("\n")
+    log.info("package diff written to %s" % path)
+
+
+def write_allowlist(installed, path, pin_versions=False):
+    """
+    Regenerate an allowlist file from the packages installed in a known-good
+    image
+
+    By default only package names are written, so any version or arch is
+    accepted. With pin_versions, every installed version and arch is written
+    as a constraint.
+    """
+
+    with open(path, 'w') as f:
+        for name in sorted(installed):
+            if pin_versions:
+                for version, arch in sorted(installed[name]):
+                    f.write("%s %s %s\n" % (name, version, arch))
+            else:
+                f.write("%s\n" % name)
+    log.info("package allowlist written to %s" % path)
@@ -0,0 +1,254 @@
+"""
+profile memory, CPU and IO usage of base runtime docker containers
+
+A ContainerProfiler samples the cgroup counters of every running container
+created from a given docker image at a fixed interval. Both cgroup v1
+(cgroupfs or systemd driver) and the cgroup v2 unified hierarchy are
+supported.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+
+
+log = logging.getLogger('avocado.test')
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+CSV_HEADER = ("timestamp,container,memory_bytes,memory_peak_bytes,cpu_ns,"
+              "io_read_bytes,io_write_bytes\n")
+
+
+def _read_file(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def _cgroup_dirs(controller, container_id):
+    """
+    Candidate cgroup directories of a container for a controller, for the
+    cgroupfs and systemd docker cgroup drivers
+    """
+
+    base = os.path.join(CGROUP_ROOT, controller) if controller else CGROUP_ROOT
+    return [os.path.join(base, "docker", container_id),
+            os.path.join(base, "system.slice", "docker-%s.scope" % container_id)]
+
+
+def _read_counter(controller, container_id, filename):
+    for cgroup_dir in _cgroup_dirs(controller, container_id):
+        contents = _read_file(os.path.join(cgroup_dir, filename))
+        if contents is not None:
+            return contents
+    return None
+
+
+def _sample_cgroup_v1(container_id):
+    memory = _read_counter("memory", container_id, "memory.usage_in_bytes")
+    if memory is None:
+        return None
+    memory_peak = _read_counter("memory", container_id, "memory.max_usage_in_bytes")
+    cpu = _read_counter("cpuacct", container_id, "cpuacct.usage")
+    io_read = io_write = 0
+    blkio = _read_counter("blkio", container_id,
+                          "blkio.throttle.io_service_bytes") or ""
+    for line in blkio.splitlines():
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        if fields[1] == "Read":
+            io_read += int(fields[2])
+        elif fields[1] == "Write":
+            io_write += int(fields[2])
+    return (int(memory), int(memory_peak or memory), int(cpu or 0),
+            io_read, io_write)
+
+
+def _sample_cgroup_v2(container_id):
+    memory = _read_counter(None, container_id, "memory.current")
+    if memory is None:
+        return None
+    # memory.peak is only available from Linux 5.19
+    memory_peak = _read_counter(None, container_id, "memory.peak")
+    cpu = 0
+    cpu_stat = _read_counter(None, container_id, "cpu.stat") or ""
+    for line in cpu_stat.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == "usage_usec":
+            cpu = int(fields[1]) * 1000
+    io_read = io_write = 0
+    io_stat = _read_counter(None, container_id, "io.stat") or ""
+    for line in io_stat.splitlines():
+        for field in line.split()[1:]:
+            key, _, value = field.partition("=")
+            if key == "rbytes":
+                io_read += int(value)
+            elif key == "wbytes":
+                io_write += int(value)
+    return (int(memory), int(memory_peak or memory), cpu, io_read, io_write)
+
+
+def sample_container(container_id):
+    """
+    Read the current (memory_bytes, memory_peak_bytes, cpu_ns,
+    io_read_bytes, io_write_bytes) counters of a container, or None if its
+    cgroup can't be found
+
+    memory_peak_bytes is the kernel's memory high-water mark for the
+    container, which catches allocation spikes shorter than the sampling
+    interval. It falls back to memory_bytes where the kernel doesn't
+    provide one.
+    """
+
+    sample = _sample_cgroup_v1(container_id)
+    if sample is None:
+        sample = _sample_cgroup_v2(container_id)
+    return sample
+
+
+def list_containers(img_name):
+    """
+    List the full ids of the running containers created from an image
+    """
+
+    cmdline = 'docker ps --no-trunc -q --filter=ancestor=%s' % img_name
+    try:
+        output = subprocess.check_output(cmdline, stderr=subprocess.STDOUT,
+                                         shell=True)
+    except subprocess.CalledProcessError as e:
+        log.debug("command '%s' returned exit status %d; output:\n%s" %
+                  (e.cmd, e.returncode, e.output))
+        return []
+    if not isinstance(output, str):
+        output = output.decode()
+    return output.split()
+
+
+class ContainerProfiler(threading.Thread):
+    """
+    Sample the resource usage of the containers of an image in the background
+
+    Every sample is appended to a CSV time-series file. Call stop() to end
+    sampling; summary() then returns the peak and average figures.
+    """
+
+    def __init__(self, img_name, interval, series_path):
+        super(ContainerProfiler, self).__init__()
+        self.daemon = True
+        self.img_name = img_name
+        self.interval = interval
+        self.series_path = series_path
+        self._stopped = threading.Event()
+        self._start_time = None
+        self._end_time = None
+        # total memory of all containers at each sampling point
+        self._memory_totals = []
+        # highest kernel memory high-water mark seen per container
+        self._memory_peaks = {}
+        # first and last seen cumulative (cpu_ns, io_read, io_write) per
+        # container
+        self._baseline = {}
+        self._cumulative = {}
+        self._first_sample = True
+        # number of containers whose counters could not be read
+        self._errors = 0
+
+    def run(self):
+        self._start_time = time.time()
+        with open(self.series_path, 'w') as series:
+            series.write(CSV_HEADER)
+            while True:
+                self._safe_sample(series)
+                if self._stopped.wait(self.interval):
+                    break
+            # catch anything that happened since the last interval
+            self._safe_sample(series)
+        self._end_time = time.time()
+
+    def _safe_sample(self, series):
+        try:
+            self._sample(series)
+        except Exception:
+            log.exception("sampling container resource usage failed")
+            self._errors += 1
+
+    def _sample(self, series):
+        timestamp = time.time()
+        memory_total = 0
+        sampled = False
+        for container_id in list_containers(self.img_name):
+            try:
+                sample = sample_container(container_id)
+            except ValueError:
+                log.exception("could not parse cgroup counters of container %s" %
+                              container_id[:12])
+                self._errors += 1
+                continue
+            if sample is None:
+                continue
+            sampled = True
+            memory, memory_peak, cpu, io_read, io_write = sample
+            memory_total += memory
+            self._memory_peaks[container_id] = max(
+                memory_peak, self._memory_peaks.get(container_id, 0))
+            if container_id not in self._baseline:
+                # containers already running when profiling started only
+                # count usage from then on; later ones count from creation
+                if self._first_sample:
+                    self._baseline[container_id] = (cpu, io_read, io_write)
+                else:
+                    self._baseline[container_id] = (0, 0, 0)
+            self._cumulative[container_id] = (cpu, io_read, io_write)
+            series.write("%.3f,%s,%d,%d,%d,%d,%d\n" %
+                         (timestamp, container_id[:12], memory, memory_peak,
+                          cpu, io_read, io_write))
+        self._first_sample = False
+        if sampled:
+            self._memory_totals.append(memory_total)
+        series.flush()
+
+    def stop(self):
+        """
+        Stop sampling and wait for the final sample to be written
+        """
+
+        self._stopped.set()
+        self.join()
+
+    def summary(self):
+        """
+        Peak and average resource usage over the profiled period
+
+        The memory peak is the highest of the sampled totals and of the
+        kernel high-water marks of the individual containers. CPU time and IO
+        bytes are summed over every container seen since profiling started,
+        so that short-lived containers started during a test are accounted
+        for. A non-zero 'errors' count means some counters could not be read
+        and the figures are incomplete.
+        """
+
+        duration = (self._end_time or time.time()) - (self._start_time or time.time())
+        usage = [[last - first for first, last in
+                  zip(self._baseline[container_id], cumulative)]
+                 for container_id, cumulative in self._cumulative.items()]
+        cpu_ns = sum(u[0] for u in usage)
+        memory = self._memory_totals
+        memory_peak = max(memory + list(self._memory_peaks.values()) or [0])
+        return {
+            'samples': len(memory),
+            'containers': len(self._cumulative),
+            'duration_s': round(duration, 3),
+            'memory_peak_bytes': memory_peak,
+            'memory_avg_bytes': sum(memory) // len(memory) if memory else 0,
+            'cpu_s': round(cpu_ns / 1e9, 3),
+            'cpu_avg_percent': round(100.0 * cpu_ns / 1e9 / duration, 1) if duration else 0.0,
+            'io_read_bytes': sum(u[1] for u in usage),
+            'io_write_bytes': sum(u[2] for u in usage),
+            'errors': self._errors,
+        }
@@ -19,42 +19,31 @@ class BaseRuntimeSetupDocker(module_framework.CommonFunctions, Test):
 
     def setUp(self):
 
-        self.mockcfg = brtconfig.get_mockcfg(self)
-        self.br_image_name = brtconfig.get_docker_image_name(self)
+        self.brtconfig = brtconfig.get_config(self, required=('mockcfg',))
+        self.mockcfg = self.brtconfig.mockcfg
+        self.br_image_name = self.brtconfig.docker_image_name
 
     def _process_mockcfg(self):
 
         mockcfg = self.mockcfg
 
-        mock_root = ''
-        mockcfg_lines = []
-        #Regex to get packages that are configured on mockcfg to be installed
-        chroot_setup_pkg_regex = re.compile("config_opts\s*\[\s*'chroot_setup_cmd'\s*\]\s*="
-                                            "\s*'install --setopt=tsflags=nodocs\s*(.*)\s*'")
-        chroot_setup_pkgs = None
-        with open(mockcfg, 'r') as mock_cfgfile:
-            found_setup_cmd = False
-            for line in mock_cfgfile:
-                mockcfg_lines.append(line)
-                if re.match("config_opts\s*\[\s*'root'\s*\]", line) is not None:
-                    mock_root = line.split('=')[1].split("'")[1]
-                if re.match("config_opts\s*\[\s*'chroot_setup_cmd'\s*\]", line) is not None:
-                    found_setup_cmd = True
-                    #Check if there are packages defined on chroot_setup_cmd
-                    m = chroot_setup_pkg_regex.match(line)
-                    if m:
-                        chroot_setup_pkgs = sorted(m.group(1).split())
+        mockcfg_model = self.brtconfig.mockcfg_model
+        mock_root = mockcfg_model['root']
+        chroot_setup_pkgs = mockcfg_model['chroot_setup_pkgs']
         if len(mock_root) == 0:
             self.error("mock configuration file %s does not specify mock root" %
                 mockcfg)
         self.log.info("mock root: %s" % mock_root)
         self.mock_root = mock_root
 
-        if not found_setup_cmd:
+        if not mockcfg_model['chroot_setup_cmd']:
             self.error("mock configuration file %s does not define chroot_setup_cmd" % mockcfg)
 
         #Need to get all packages that need to be installed
-        mod_yaml = self.getModulemdYamlconfig()
+        try:
+            mod_yaml = self.getModulemdYamlconfig()
+        except Exception as e:
+            self.error("Could not read modulemd Yaml file: %s" % e)
         if not mod_yaml:
             self.error("Could not read modulemd Yaml file")
 
@@ -80,6 +69,8 @@ class BaseRuntimeSetupDocker(module_framework.CommonFunctions, Test):
             #Need to change chroot_setup_cmd line on mockcfg file
             setup_cmd = "install --setopt=tsflags=nodocs "
             setup_cmd += " ".join(req_pkgs)
+            with open(mockcfg, 'r') as mock_cfgfile:
+                mockcfg_lines = mock_cfgfile.readlines()
             with open(mockcfg, 'w') as mock_cfgfile:
                 for line in mockcfg_lines:
                     if re.match("config_opts\s*\[\s*'chroot_setup_cmd'\s*\]", line) is not None:
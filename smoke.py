@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import json
 import os
 import subprocess
 import re
@@ -12,6 +13,8 @@ from avocado import main
 from moduleframework import module_framework
 
 import brtconfig
+import pkgdiff
+import resprofile
 
 
 class BaseRuntimeSmokeTest(module_framework.AvocadoTest):
@@ -21,9 +24,42 @@ class BaseRuntimeSmokeTest(module_framework.AvocadoTest):
 
     def setUp(self):
         super(self.__class__, self).setUp()
-        self.compiler_resource_dir = brtconfig.get_compiler_test_dir(self)
-        self.br_image_name = brtconfig.get_docker_image_name(self)
+        self.brtconfig = brtconfig.get_config(self, required=('compiler_test_dir', 'profile_interval'))
+        self.compiler_resource_dir = self.brtconfig.compiler_test_dir
+        self.br_image_name = self.brtconfig.docker_image_name
+        self.installed_pkgs_list = self.brtconfig.installed_pkgs_list
         self.compiler_test_dir = None
+        self.profiler = None
+        self._start_profiler()
+
+    def _start_profiler(self):
+        """
+        Start sampling the resource usage of the test containers
+        """
+
+        interval = self.brtconfig.profile_interval
+        if not interval:
+            return
+        series_path = os.path.join(self.outputdir, "resource_profile.csv")
+        self.profiler = resprofile.ContainerProfiler(
+            self.br_image_name, interval, series_path)
+        self.profiler.start()
+
+    def _stop_profiler(self):
+        """
+        Stop sampling and attach the resource usage summary to the test result
+        """
+
+        if not self.profiler:
+            return
+        self.profiler.stop()
+        summary = self.profiler.summary()
+        self.log.info("container resource usage: %s" % summary)
+        if summary['errors']:
+            self.log.warning("%d container resource samples failed, resource "
+                             "usage figures are incomplete" % summary['errors'])
+        self.whiteboard = json.dumps({'resources': summary}, sort_keys=True)
+        self.profiler = None
 
     def _check_cmd_result(self, cmd, return_code, cmd_output, expect_pass=True):
         """
@@ -81,7 +117,10 @@ class BaseRuntimeSmokeTest(module_framework.AvocadoTest):
         Check if all required packages defined on yaml file are installed
         """
 
-        mod_yaml = self.getModulemdYamlconfig()
+        try:
+            mod_yaml = self.getModulemdYamlconfig()
+        except Exception as e:
+            self.error("Could not read modulemd Yaml file: %s" % e)
         if not mod_yaml:
             self.error("Could not read modulemd Yaml file")
 
@@ -108,29 +147,65 @@ class BaseRuntimeSmokeTest(module_framework.AvocadoTest):
             if req_pkg not in installed_pkgs:
                 self.error("Required package '%s' is not installed" % req_pkg)
 
+    def _get_installed_pkg_versions(self):
+        try:
+            cmd_result = self.run("rpm -qa --qf='%s'" % pkgdiff.RPM_QUERY_FORMAT)
+        except:
+            self.error("Could not get all installed packages")
+        return pkgdiff.parse_installed(cmd_result.stdout)
+
+    def _get_bool_param(self, name):
+        value = self.params.get(name, default=False)
+        return str(value).lower() in ("1", "true", "yes")
+
     def testInstalledPackages(self):
         """
         Check if only the expected packages are installed on module
+
+        The complete difference against the expected packages list is written
+        to 'installed_pkgs_diff.json' in the test output directory. If the
+        'regenerate-installed-pkgs' parameter is set, the expected packages
+        list is rewritten from the image instead ('pin-installed-pkgs' also
+        records versions and arches). Expected packages that are not
+        installed only fail the test if 'strict-installed-pkgs' is set.
         """
 
+        installed_pkgs = self._get_installed_pkg_versions()
+        if not installed_pkgs:
+            self.error("It seems there is no package installed in the module")
+
+        if self._get_bool_param('regenerate-installed-pkgs'):
+            try:
+                pkgdiff.write_allowlist(
+                    installed_pkgs, self.installed_pkgs_list,
+                    pin_versions=self._get_bool_param('pin-installed-pkgs'))
+            except IOError as e:
+                self.error("Could not write the expected installed packages list: %s" %
+                           e.strerror)
+            return
+
         expected_pkgs = None
-        all_installed_pkgs_path = "resources/installed_packages/all_installed_pkgs.txt"
         try:
-            with open(all_installed_pkgs_path) as f:
-                expected_pkgs = f.read().splitlines()
+            expected_pkgs = self.brtconfig.installed_pkgs
         except:
             self.error("Could not read the expected installed packages list")
 
         if not expected_pkgs:
             self.error("List of expected installed packages is empty")
 
-        installed_pkgs = self._get_all_installed_pkgs()
-        if not installed_pkgs:
-            self.error("It seems there is no package installed in the module")
+        diff = pkgdiff.diff_packages(expected_pkgs, installed_pkgs)
+        pkgdiff.write_diff(diff, os.path.join(self.outputdir,
+                                              "installed_pkgs_diff.json"))
 
-        for pkg in installed_pkgs:
-            if pkg not in expected_pkgs:
-                self.error("Did not expect to have package '%s' installed" % pkg)
+        strict = self._get_bool_param('strict-installed-pkgs')
+        if pkgdiff.has_drift(diff, strict=strict):
+            self.error("Installed packages differ from the expected list "
+                       "(%d added, %d removed, %d changed):\n%s" %
+                       (len(diff['added']), len(diff['removed']),
+                        len(diff['changed']), pkgdiff.format_diff(diff)))
+        elif diff['removed']:
+            self.log.info("Expected packages not installed:\n%s" %
+                          pkgdiff.format_diff(diff))
 
     def testUserManipulation(self):
         """
@@ -360,6 +435,8 @@ class BaseRuntimeSmokeTest(module_framework.AvocadoTest):
         """
         Tear-down
         """
+        self._stop_profiler()
+
         super(self.__class__, self).tearDown()
 
         self._cleanup_compiler_test_directory()
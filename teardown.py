@@ -15,8 +15,9 @@ class BaseRuntimeTeardownDocker(Test):
 
     def setUp(self):
 
-        self.mockcfg = brtconfig.get_mockcfg(self)
-        self.br_image_name = brtconfig.get_docker_image_name(self)
+        self.brtconfig = brtconfig.get_config(self, required=('mockcfg',))
+        self.mockcfg = self.brtconfig.mockcfg
+        self.br_image_name = self.brtconfig.docker_image_name
 
     def testRemoveDockerImage(self):
 